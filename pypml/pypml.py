@@ -13,18 +13,92 @@ import logging
 import operator
 import os
 import sys
+import types
 import xml.etree.ElementTree
 
-from numpy.random import RandomState
+import numpy
+
+try:
+    from numba import njit
+except ImportError:
+    ## numba is an optional accelerator, the pure-numpy path is used without it
+    njit = None
 
 # """ Import TraCI library """
-if 'SUMO_TOOLS' in os.environ:
+if os.environ.get('PYPML_LIBSUMO'):
+    ## libsumo implements the TraCI Python API in-process, removing the TCP
+    ## round-trip from every call. Step listeners are not supported by libsumo:
+    ## step() must be called by hand every simulation step.
+    import libsumo as traci
+    import libsumo.constants as tc
+elif 'SUMO_TOOLS' in os.environ:
     sys.path.append(os.environ['SUMO_TOOLS'])
     import traci
     import traci.constants as tc
 else:
     sys.exit("""The PyPML package uses SUMO TraCI API.
-             Please declare the environment variable 'SUMO_TOOLS'""")
+             Please declare the environment variable 'SUMO_TOOLS'
+             (or PYPML_LIBSUMO to use libsumo).""")
+
+try:
+    _TRACI_EXCEPTION = traci.exceptions.TraCIException
+except AttributeError:
+    ## libsumo exposes the exception at the top level
+    _TRACI_EXCEPTION = traci.TraCIException
+
+def _shallow_snapshot(item):
+    """ Return a copy of a DB record, recursing only into the basic containers.
+
+        The records stored in the internal DBs are made of primitives, strings,
+        tuples and flat containers, so a targeted rebuild is sufficient and avoids
+        the memo bookkeeping and per-object dispatch of copy.deepcopy.
+    """
+    if isinstance(item, (dict, _ParkingRecord)):
+        return {key: _shallow_snapshot(value) for key, value in item.items()}
+    if isinstance(item, _Subscription):
+        ## the vehicles frozenset is immutable and can be shared
+        return (item.capacity, item.vehicles)
+    if isinstance(item, tuple):
+        return tuple(_shallow_snapshot(value) for value in item)
+    if isinstance(item, (list, set)):
+        ## the items are primitives or immutable tuples
+        return item.copy()
+    if isinstance(item, numpy.ndarray):
+        return item.copy()
+    return item
+
+def _plain_same_destinations(a_ids, b_ids):
+    """ Return True iff the two stop signature arrays are identical. """
+    if a_ids.shape[0] != b_ids.shape[0]:
+        return False
+    for pos in range(a_ids.shape[0]):
+        if a_ids[pos] != b_ids[pos]:
+            return False
+    return True
+
+if njit is not None:
+    _same_destinations = njit(cache=True)(_plain_same_destinations)
+else:
+    def _same_destinations(a_ids, b_ids):
+        """ Return True iff the two stop signature arrays are identical. """
+        return bool(numpy.array_equal(a_ids, b_ids))
+
+def _is_parking_area(flags):
+    """ isStoppedParking(string) -> bool
+        Return whether the vehicle is parking (implies stopped)
+
+        The flags integer is defined as
+           1 * stopped +
+           2 * parking +
+           4 * personTriggered +
+           8 * containerTriggered +
+          16 * isBusStop +
+          32 * isContainerStop +
+          64 * chargingStation +
+         128 * parkingarea
+        with each of these flags defined as 0 or 1
+    """
+    return (flags & 128) == 128
 
 class ParkingMonitorGenericError(Exception):
     """ Parking Monitor Exception Class """
@@ -38,8 +112,144 @@ class ParkingMonitorGenericError(Exception):
     def __str__(self):
         return self.message
 
-class ParkingMonitor(traci.StepListener):
-    """ SUMO StepListener class for the parking monitoring. """
+class ParkingAreaNotFoundError(ParkingMonitorGenericError):
+    """ Raised when the requested parking area is not monitored.
+
+        The message is built lazily in __str__, so callers that catch the
+        error and recover never pay for the formatting. It subclasses
+        ParkingMonitorGenericError to keep the historical except clauses
+        working.
+    """
+
+    def __init__(self, parking):
+        """ Init the error with the missing parking area ID. """
+        super().__init__()
+        self.parking = parking
+
+    def __str__(self):
+        return 'Parking {} does not exist.'.format(self.parking)
+
+## Gaussian noise parameters of a parking area: two fixed fields, read on every
+## get_free_places(with_uncertainty=True) call, so a dict would cost two hash
+## lookups (and a dict header per parking) for nothing.
+_Uncertainty = collections.namedtuple('_Uncertainty', ('mu', 'sigma'))
+
+class _Subscription:
+    """ Subscription slots of a parking area for a single vClass.
+
+        free caches capacity - len(vehicles) so that the full check in
+        subscribe_vehicle_to_parking and the per-class loop of
+        get_free_places read a plain int instead of recomputing it.
+        Iterating yields (capacity, vehicles), keeping the historical
+        2-tuple unpacking of the public snapshots.
+    """
+
+    __slots__ = ('capacity', 'vehicles', 'free')
+
+    def __init__(self, capacity, vehicles):
+        self.capacity = capacity
+        ## frozenset: mutations are rare while the read paths are hot, and a
+        ## frozenset can be handed out and combined without defensive copies
+        self.vehicles = frozenset(vehicles)
+        self.free = capacity - len(self.vehicles)
+
+    def __iter__(self):
+        yield self.capacity
+        yield self.vehicles
+
+    def __repr__(self):
+        return repr((self.capacity, set(self.vehicles)))
+
+class _ParkingRecord:
+    """ Record of a single parking area with a fixed set of fields.
+
+        __slots__ replaces the historical per-parking dict of string keys:
+        attribute access becomes a direct offset lookup and the per-record
+        memory shrinks by the size of a dict header. The mapping protocol is
+        kept on top so that the public accessors and the configuration
+        expressions can keep addressing the fields as record['field'].
+    """
+
+    ## fields exposed through the mapping protocol, in insertion order
+    _FIELDS = ('sumo', 'total_capacity', 'total_occupancy',
+               'occupancy_chunks', 'occupancy_chunk_pos',
+               'occupancy_by_class', 'projections_by_class',
+               'capacity_by_class', 'subscriptions_by_class',
+               'uncertainty', 'free_by_class')
+
+    ## capacity_sum/occupancy_sum are internal running totals of the *_by_class
+    ## containers, maintained incrementally so the validators compare two ints
+    ## instead of re-summing the dicts on every call
+    __slots__ = _FIELDS + ('capacity_sum', 'occupancy_sum', '_extra')
+
+    def __init__(self, sumo):
+        self.sumo = sumo
+        self.total_capacity = 0
+        self.total_occupancy = 0
+        self.occupancy_chunks = None
+        self.occupancy_chunk_pos = 0
+        self.occupancy_by_class = dict()
+        self.projections_by_class = dict()
+        self.capacity_by_class = dict()
+        self.subscriptions_by_class = dict()
+        self.uncertainty = None
+        self.free_by_class = dict()
+        self.capacity_sum = 0
+        self.occupancy_sum = 0
+        ## custom keys assigned through the generic configuration, if any
+        self._extra = None
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            if self._extra is not None and key in self._extra:
+                return self._extra[key]
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key in self._FIELDS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = dict()
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        if key in self._FIELDS:
+            return True
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        yield from self._FIELDS
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return len(self._FIELDS) + (len(self._extra) if self._extra else 0)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for key in self._FIELDS:
+            yield key, getattr(self, key)
+        if self._extra:
+            yield from self._extra.items()
+
+class ParkingMonitor(getattr(traci, 'StepListener', object)):
+    """ SUMO StepListener class for the parking monitoring.
+
+        Under libsumo (PYPML_LIBSUMO) there is no StepListener support and
+        step() must be called by hand every simulation step.
+    """
+
+    ## Radius (in meters) of the vehicle context subscription, large enough to cover
+    ## every vehicle in the scenario.
+    VEHICLE_CONTEXT_RANGE = 1000000.0
+
+    ## Number of (occupancy, step) samples per chunk of the occupancy series.
+    OCCUPANCY_SERIES_CHUNK = 4096
 
     _logger = None
     _options = None
@@ -50,11 +260,25 @@ class ParkingMonitor(traci.StepListener):
     _vehicles_db = dict()
     _passengers_db = set()
 
+    ## vehicles subscribed by PyPML and still monitored (see _update_vehicles_db)
+    _vehicles_with_stops = set()
+
     _edges_routers_mapping = collections.defaultdict(list)
 
-    _blacklisted_edges_pairs = collections.defaultdict(list)
+    ## stopping place id (string) -> int64 code, for the stop signature arrays
+    _stop_id_vocabulary = dict()
+
+    _blacklisted_edges_pairs = collections.defaultdict(set)
     _static_parking_travel_time = collections.defaultdict(list)
 
+    ## hot per-step scalars kept in parallel numpy arrays (see _check_occupancy)
+    _pid_list = None
+    _pid_to_idx = None
+    _capacity_arr = None
+    _occupancy_arr = None
+    _mu_arr = None
+    _sigma_arr = None
+
     _traci_handler = None
     _traci_arrived_list = None
     _traci_departed_list = None
@@ -103,7 +327,7 @@ class ParkingMonitor(traci.StepListener):
 
         Options format:
         {
-            'seed': Integer. Initialization seed for numpy.random.RandomState.
+            'seed': Integer. Initialization seed for numpy.random.default_rng.
             'addStepListener': Boolean. Ff True, pypml is added as step listener in SUMO.
                                In case it's False the function step() must be called by hand every
                                simulation step.
@@ -168,11 +392,15 @@ class ParkingMonitor(traci.StepListener):
 
         self._options = options
 
+        ## the vclasses are compared against dict key views in the validators,
+        ## a frozenset avoids rebuilding a set of keys on every comparison
+        self._options['vclasses'] = frozenset(options['vclasses'])
+
         ## Random generator initialization
         if 'seed' in options:
-            self._random = RandomState(seed=options['seed'])
+            self._random = numpy.random.default_rng(options['seed'])
         else:
-            self._random = RandomState()
+            self._random = numpy.random.default_rng()
 
         ## Logs initialization
         self._logs()
@@ -184,6 +412,22 @@ class ParkingMonitor(traci.StepListener):
         ## Read parkings and routers from SUMO add.xml
         self._load_parkings_and_routers()
 
+        ## Pre-compile the generic configuration: conditions and expressions are fixed,
+        ## but evaluated once per parking area.
+        compiled_generic_conf = []
+        for gopt in options['generic_conf']:
+            compiled_set_to = []
+            for key, value in gopt['set_to']:
+                if key == 'uncertainty':
+                    compiled_set_to.append((key, {
+                        'mu': self._compile_expression(value['mu']),
+                        'sigma': self._compile_expression(value['sigma']),
+                    }))
+                else:
+                    compiled_set_to.append((key, value))
+            compiled_generic_conf.append(
+                (self._compile_expression(gopt['cond']), compiled_set_to))
+
         ## Populate the parking configurations
         total = 0
         for pid, parking in self._parking_db.items():
@@ -191,54 +435,76 @@ class ParkingMonitor(traci.StepListener):
                 self._traci_handler.simulation.getParameter(pid, 'parkingArea.capacity'))
             occupancy = int(
                 self._traci_handler.simulation.getParameter(pid, 'parkingArea.occupancy'))
-            parking['total_capacity'] = capacity   # TraCI value
-            parking['total_occupancy'] = occupancy # TraCI value
-            parking['occupancy_series'] = [(occupancy, time)]
-            parking['occupancy_by_class'] = dict()
-            parking['projections_by_class'] = dict()
+            parking.total_capacity = capacity   # TraCI value
+            parking.total_occupancy = occupancy # TraCI value
+            parking.occupancy_chunks = [
+                numpy.empty((self.OCCUPANCY_SERIES_CHUNK, 2), dtype=numpy.float64)]
+            parking.occupancy_chunk_pos = 0
+            self._append_occupancy_sample(parking, occupancy, time)
             for vclass in self._options['vclasses']:
-                parking['occupancy_by_class'][vclass] = set()
-                parking['projections_by_class'][vclass] = set()
+                parking.occupancy_by_class[vclass] = set()
+                parking.projections_by_class[vclass] = set()
 
             ## Set DEFAULT values.
-            parking['capacity_by_class'] = dict()
-            parking['subscriptions_by_class'] = dict()
-            parking['uncertainty'] = {
-                'mu': 0.0,
-                'sigma': 0.0,
-            }
+            parking.uncertainty = _Uncertainty(0.0, 0.0)
 
             ## Apply GENERAL CONFIGURATIONS
-            for gopt in options['generic_conf']:
-                if self._parse_generic_condition(gopt['cond'], parking):
-                    for key, value in gopt['set_to']:
+            for condition, set_to in compiled_generic_conf:
+                if condition(parking):
+                    for key, value in set_to:
                         if key == 'uncertainty':
-                            parking['uncertainty'] = {
-                                'mu': self._eval_expression(value['mu'], parking),
-                                'sigma': self._eval_expression(value['sigma'], parking),
-                            }
+                            parking.uncertainty = _Uncertainty(
+                                value['mu'](parking), value['sigma'](parking))
+                        elif key == 'subscriptions_by_class':
+                            parking.subscriptions_by_class = {
+                                vclass: _Subscription(num, veh)
+                                for vclass, (num, veh) in value.items()}
                         else:
                             ## not sure what this can be
-                            parking[key] = copy.deepcopy(value)
+                            parking[key] = _shallow_snapshot(value)
 
             ## Apply SPECIFIC VALUES
-            if pid in options['specific_conf'].keys():
-                if 'capacity_by_class' in options['specific_conf'][pid]:
-                    parking['capacity_by_class'] = copy.deepcopy(
-                        options['specific_conf'][pid]['capacity_by_class'])
-                if 'subscriptions_by_class' in options['specific_conf'][pid]:
-                    parking['subscriptions_by_class'] = copy.deepcopy(
-                        options['specific_conf'][pid]['subscriptions_by_class'])
-                if 'uncertainty' in options['specific_conf'][pid]:
-                    parking['uncertainty'] = {
-                        'mu': self._eval_expression(
-                            options['specific_conf'][pid]['uncertainty']['mu'], parking),
-                        'sigma': self._eval_expression(
-                            options['specific_conf'][pid]['uncertainty']['sigma'], parking),
-                    }
+            spec = options['specific_conf'].get(pid)
+            if spec is not None:
+                if 'capacity_by_class' in spec:
+                    ## flat {vType: number} dict
+                    parking.capacity_by_class = dict(spec['capacity_by_class'])
+                if 'subscriptions_by_class' in spec:
+                    parking.subscriptions_by_class = {
+                        key: _Subscription(num, veh)
+                        for key, (num, veh) in spec['subscriptions_by_class'].items()}
+                if 'uncertainty' in spec:
+                    parking.uncertainty = _Uncertainty(
+                        self._eval_expression(spec['uncertainty']['mu'], parking),
+                        self._eval_expression(spec['uncertainty']['sigma'], parking))
+
+            ## Incremental free-places counters and running totals, kept in sync
+            ## with the *_by_class containers (see the get_free_places fast path
+            ## and the validators).
+            parking.free_by_class = {
+                key: value - len(parking.occupancy_by_class[key])
+                for key, value in parking.capacity_by_class.items()}
+            parking.capacity_sum = sum(parking.capacity_by_class.values())
 
             total += capacity
 
+        ## Hot per-step scalars in parallel numpy arrays (pid -> index), so that the
+        ## occupancy check is a single vectorized comparison instead of P dict walks.
+        self._pid_list = sorted(self._parking_db)
+        self._pid_to_idx = {pid: idx for idx, pid in enumerate(self._pid_list)}
+        self._capacity_arr = numpy.array(
+            [self._parking_db[pid].total_capacity for pid in self._pid_list],
+            dtype=numpy.int32)
+        self._occupancy_arr = numpy.array(
+            [self._parking_db[pid].total_occupancy for pid in self._pid_list],
+            dtype=numpy.int32)
+        self._mu_arr = numpy.array(
+            [self._parking_db[pid].uncertainty.mu for pid in self._pid_list],
+            dtype=numpy.float64)
+        self._sigma_arr = numpy.array(
+            [self._parking_db[pid].uncertainty.sigma for pid in self._pid_list],
+            dtype=numpy.float64)
+
         if self._logger:
             self._logger.info('Monitoring %s parkings with a total capacity of %d.',
                               len(self._parking_db), total)
@@ -247,26 +513,45 @@ class ParkingMonitor(traci.StepListener):
         self._traci_handler.simulation.subscribe(varIDs=(tc.VAR_PARKING_STARTING_VEHICLES_IDS,
                                                          tc.VAR_PARKING_ENDING_VEHICLES_IDS))
 
+        ## Parking occupancy subscriptions: one subscription per parking area instead of
+        ## one getParameter() round-trip per parking area per simulation step.
+        for pid in self._parking_db:
+            self._traci_handler.parkingarea.subscribe(
+                pid, varIDs=(tc.VAR_STOP_STARTING_VEHICLES_NUMBER,))
+
+        ## Vehicle context subscription: class, planned stops and passengers of every active
+        ## vehicle are piggybacked on the simulation subscription so that newly departed
+        ## vehicles can be screened without three round-trips each.
+        self._traci_handler.simulation.subscribeContext(
+            '', tc.CMD_GET_VEHICLE_VARIABLE, self.VEHICLE_CONTEXT_RANGE,
+            varIDs=(tc.VAR_VEHICLECLASS, tc.VAR_NEXT_STOPS, tc.LAST_STEP_PERSON_ID_LIST))
+
         ## StepListener registration
         if self._options['addStepListener']:
-            self._traci_handler.addStepListener(self)
+            if hasattr(self._traci_handler, 'addStepListener'):
+                self._traci_handler.addStepListener(self)
+            elif self._logger:
+                self._logger.warning('addStepListener is not supported (e.g. by libsumo): '
+                                     'step() must be called by hand every simulation step.')
 
     def _load_parkings_and_routers(self):
         """ Load the parking and routers definition from SUMO add.xml and apply restrictions. """
 
         filename = self._options['sumo_parking_file']
-        xml_tree = xml.etree.ElementTree.parse(filename).getroot()
-
-        for child in xml_tree:
-            if child.tag == 'parkingArea' and child.attrib['id'] not in self._options['blacklist']:
-                self._parking_db[child.attrib['id']] = {
-                    'sumo': child.attrib,
-                }
+        blacklist = set(self._options['blacklist'])
+
+        ## iterparse streams the add.xml: each handled element is cleared once processed,
+        ## so the resident set stays small even with thousands of parking areas.
+        for _, child in xml.etree.ElementTree.iterparse(filename, events=('end',)):
+            if child.tag == 'parkingArea':
+                if child.attrib['id'] not in blacklist:
+                    self._parking_db[child.attrib['id']] = _ParkingRecord(dict(child.attrib))
+                child.clear()
             ## rerouters
             elif child.tag == 'rerouter':
                 self._routers_db[child.attrib['id']] = {
                     'id': child.attrib['id'],
-                    'edges': child.attrib['edges'].strip(' ').split(' '),
+                    'edges': child.attrib['edges'].split(),
                     'intervals': list(),
                 }
 
@@ -284,6 +569,16 @@ class ParkingMonitor(traci.StepListener):
                             parkings.append((area.attrib['id'], False))
                     self._routers_db[child.attrib['id']]['intervals'].append((_end, parkings))
 
+                ## sorted interval endpoints in a numpy array, with a parallel list of
+                ## parkings, so that get_rerouter_iterator can use a binary search.
+                intervals = self._routers_db[child.attrib['id']]['intervals']
+                intervals.sort(key=operator.itemgetter(0))
+                self._routers_db[child.attrib['id']]['intervals_end'] = numpy.array(
+                    [end for end, _ in intervals], dtype=numpy.float64)
+                self._routers_db[child.attrib['id']]['intervals_parkings'] = [
+                    parkings for _, parkings in intervals]
+                child.clear()
+
         if self._routers_db:
             if self._logger:
                 self._logger.warning("""The parking rerouters that are define in SUMO additional
@@ -291,45 +586,55 @@ class ParkingMonitor(traci.StepListener):
                                      (e.g. traci.vehicle.rerouteParkingArea).""")
 
 
-    @staticmethod
-    def _get_operator(oper):
+    ## Operators usable in the generic configuration conditions and expressions.
+    _OPERATORS = {
+        'and': operator.and_,
+        'or': operator.or_,
+        '>': operator.gt,
+        '>=': operator.ge,
+        '=': operator.eq,
+        '<=': operator.le,
+        '<': operator.lt,
+        '+': operator.add,
+        '-': operator.sub,
+        '*': operator.mul,
+        '/': operator.truediv,
+        '**': operator.pow,
+    }
+
+    @classmethod
+    def _get_operator(cls, oper):
         """ Return the function associated to the operator. """
-        return {
-            'and': operator.and_,
-            'or': operator.or_,
-            '>': operator.gt,
-            '>=': operator.ge,
-            '=': operator.eq,
-            '<=': operator.le,
-            '<': operator.lt,
-            '+': operator.add,
-            '-': operator.sub,
-            '*': operator.mul,
-            '/': operator.truediv,
-            '**': operator.pow,
-        }[oper]
-
-    def _parse_generic_condition(self, condition, environment):
-        """ Parse the generic condition and returns True or False accordingly. """
-        oper, operand_1, operand_2 = condition
+        return cls._OPERATORS[oper]
 
-        if isinstance(operand_1, list):
-            operand_1 = self._parse_generic_condition(operand_1, environment)
-        if isinstance(operand_2, list):
-            operand_2 = self._parse_generic_condition(operand_2, environment)
+    @classmethod
+    def _compile_expression(cls, expr):
+        """ Compile a prefix-notation expression (or condition) into a callable(environment).
 
-        if operand_1 in environment:
-            operand_1 = environment[operand_1]
-        if operand_2 in environment:
-            operand_2 = environment[operand_2]
+            The generic configuration is fixed at construction time, so each tree is
+            compiled once into nested closures instead of being re-interpreted for
+            every parking area.
+        """
+        ## leaf: environment lookup or literal
+        if not isinstance(expr, list):
+            if not isinstance(expr, str):
+                ## numeric/boolean literal, the environment lookup would always miss
+                return lambda environment, leaf=expr: leaf
+            return lambda environment, leaf=expr: (
+                environment[leaf] if leaf in environment else leaf)
 
-        return self._get_operator(oper)(operand_1, operand_2)
+        ## complex expression
+        oper, operand_1, operand_2 = expr
+        func = cls._get_operator(oper)
+        compiled_1 = cls._compile_expression(operand_1)
+        compiled_2 = cls._compile_expression(operand_2)
+        return lambda environment: func(compiled_1(environment), compiled_2(environment))
 
     def _eval_expression(self, expr, environment):
         """ Evaluate an expression in the enviroment. """
         ## usual case with simple evaluation
         if not isinstance(expr, list):
-            if expr in environment:
+            if isinstance(expr, str) and expr in environment:
                 return environment[expr]
             return expr
 
@@ -341,9 +646,10 @@ class ParkingMonitor(traci.StepListener):
         if isinstance(operand_2, list):
             operand_2 = self._eval_expression(operand_2, environment)
 
-        if operand_1 in environment:
+        ## only string operands can be environment keys
+        if isinstance(operand_1, str) and operand_1 in environment:
             operand_1 = environment[operand_1]
-        if operand_2 in environment:
+        if isinstance(operand_2, str) and operand_2 in environment:
             operand_2 = environment[operand_2]
 
         return self._get_operator(oper)(operand_1, operand_2)
@@ -364,23 +670,7 @@ class ParkingMonitor(traci.StepListener):
 
     ## ===============================         UTILITIES         =============================== ##
 
-    @staticmethod
-    def is_parking_area(flags):
-        """ isStoppedParking(string) -> bool
-            Return whether the vehicle is parking (implies stopped)
-
-            The flags integer is defined as
-               1 * stopped +
-               2 * parking +
-               4 * personTriggered +
-               8 * containerTriggered +
-              16 * isBusStop +
-              32 * isContainerStop +
-              64 * chargingStation +
-             128 * parkingarea
-            with each of these flags defined as 0 or 1
-        """
-        return (flags & 128) == 128
+    is_parking_area = staticmethod(_is_parking_area)
 
     def get_parking_access(self, parking):
         """ Given a parking ID, returns the lane information.
@@ -388,44 +678,65 @@ class ParkingMonitor(traci.StepListener):
 
             parking: String. Parking area ID as defined in SUMO.
         """
-        if parking in self._parking_db.keys():
-            return self._parking_db[parking]['sumo']['lane']
-        raise ParkingMonitorGenericError('Parking {} does not exist.'.format(parking))
+        entry = self._parking_db.get(parking)
+        if entry is not None:
+            return entry.sumo['lane']
+        raise ParkingAreaNotFoundError(parking)
 
     ## ===============================         MONITORING        =============================== ##
 
     def _monitor_vehicles(self, step):
         """ Create subscriptions for the vehicles with planned stops in parking areas. """
-        self._traci_departed_list = self._traci_handler.simulation.getDepartedIDList()
+        ## local aliases to avoid the repeated attribute lookups in the loops below
+        pdb = self._parking_db
+        vdb = self._vehicles_db
+        sim = self._traci_handler.simulation
+        veh = self._traci_handler.vehicle
+        vehicle_context = sim.getContextSubscriptionResults('')
+        self._traci_departed_list = sim.getDepartedIDList()
         for vehicle in self._traci_departed_list:
-            v_class = self._traci_handler.vehicle.getVehicleClass(vehicle)
+            data = vehicle_context.get(vehicle) if vehicle_context else None
+            if data is not None:
+                v_class = data[tc.VAR_VEHICLECLASS]
+            else:
+                ## vehicle not (yet) in the context subscription results
+                v_class = veh.getVehicleClass(vehicle)
             if self._options['subscriptions']['only_parkings'] and v_class in ['bus', 'rail']:
                 continue
 
-            current_stops = self._traci_handler.vehicle.getNextStops(vehicle)
+            if data is not None:
+                current_stops = data[tc.VAR_NEXT_STOPS]
+            else:
+                current_stops = veh.getNextStops(vehicle)
             _parking_stops = set()
             for stop in current_stops:
                 _, _, stopping_place, stop_flags, _, _ = stop
-                if self.is_parking_area(stop_flags):
+                if stop_flags & 128:
                     _parking_stops.add(stopping_place)
 
             if self._options['subscriptions']['only_parkings'] and not _parking_stops:
                 continue
 
-            passengers = self._traci_handler.vehicle.getPersonIDList(vehicle)
+            if data is not None:
+                passengers = data[tc.LAST_STEP_PERSON_ID_LIST]
+            else:
+                passengers = veh.getPersonIDList(vehicle)
             for passenger in passengers:
                 self._passengers_db.add(passenger)
 
             if self._logger:
                 self._logger.debug('[%.2f] Vehicle %s added to subscriptions.', step, vehicle)
-            self._traci_handler.vehicle.subscribe(
+            veh.subscribe(
                 vehicle, varIDs=(tc.VAR_ROAD_ID, tc.VAR_NEXT_STOPS, tc.LAST_STEP_PERSON_ID_LIST))
+            self._vehicles_with_stops.add(vehicle)
 
-            self._vehicles_db[vehicle] = {
+            vdb[vehicle] = {
                 'id': vehicle,
                 'departure': step,
                 'edge': '',
                 'stops': current_stops,
+                'stops_signature': self._stops_signature(current_stops),
+                'parking_stops': _parking_stops,
                 'history': [],
                 'vClass': v_class,
                 'passengers': passengers,
@@ -437,63 +748,76 @@ class ParkingMonitor(traci.StepListener):
 
             ## update parking projections
             for area in _parking_stops:
-                self._parking_db[area]['projections_by_class'][v_class].add(vehicle)
+                pdb[area].projections_by_class[v_class].add(vehicle)
                 if self._logger:
                     self._logger.debug('[%.2f] Vehicle %s added to the projections of %s.',
                                        step, vehicle, area)
 
-        self._traci_arrived_list = self._traci_handler.simulation.getArrivedIDList()
+        self._traci_arrived_list = sim.getArrivedIDList()
         for vehicle in self._traci_arrived_list:
-            if vehicle in self._vehicles_db:
-                self._vehicles_db[vehicle]['arrived'] = step
+            ## arrived vehicles are unsubscribed by TraCI itself
+            self._vehicles_with_stops.discard(vehicle)
+            if vehicle in vdb:
+                vdb[vehicle]['arrived'] = step
                 if self._logger:
                     self._logger.debug('[%.2f] Vehicle %s has arrived.', step, vehicle)
 
                 ## TODO: cleanup the parking areas --> Ask Jakob.
                 parking_area = self._get_parking_area_from_vehicle(vehicle)
                 if parking_area:
-                    v_class = self._vehicles_db[vehicle]['vClass']
-                    if vehicle in self._parking_db[parking_area]['projections_by_class'][v_class]:
+                    v_class = vdb[vehicle]['vClass']
+                    parking = pdb[parking_area]
+                    if vehicle in parking.projections_by_class[v_class]:
                         if self._logger:
                             self._logger.debug(
                                 '[%.2f] Vehicle %s removed from the projections of %s.',
                                 step, vehicle, parking_area)
-                    if vehicle in self._parking_db[parking_area]['occupancy_by_class'][v_class]:
+                    if vehicle in parking.occupancy_by_class[v_class]:
                         if self._logger:
                             self._logger.debug(
                                 '[%.2f] Vehicle %s removed from parking area %s.',
                                 step, vehicle, parking_area)
 
-    @staticmethod
-    def _is_same_destinations(a_stops, b_stops):
-        """ Return true iff the series of stops ids is the same. """
-        if len(a_stops) != len(b_stops):
-            return False
-        nmr_stops = len(a_stops)
-        for pos in range(nmr_stops):
-            if a_stops[pos][2] != b_stops[pos][2]:
-                return False
-        return True
+    def _stops_signature(self, stops):
+        """ Encode the sequence of stopping places of a vehicle as an int64 array.
+
+            The string ids are mapped to integer codes through a vocabulary so that
+            the per-step destination comparison runs on numeric arrays (jitted with
+            numba when available).
+        """
+        vocabulary = self._stop_id_vocabulary
+        signature = numpy.empty(len(stops), dtype=numpy.int64)
+        for pos, stop in enumerate(stops):
+            code = vocabulary.get(stop[2])
+            if code is None:
+                code = len(vocabulary)
+                vocabulary[stop[2]] = code
+            signature[pos] = code
+        return signature
 
     def _update_vehicles_db(self, step):
         """ Update subscriptions and vechiles database. """
-        self._traci_vehicle_subscription = self._traci_handler.vehicle.getAllSubscriptionResults()
-        for vehicle, data in self._traci_vehicle_subscription.items():
+        ## local aliases to avoid the repeated attribute lookups in the loop below
+        pdb = self._parking_db
+        vdb = self._vehicles_db
+        veh = self._traci_handler.vehicle
+        self._traci_vehicle_subscription = veh.getAllSubscriptionResults()
+        ## only the vehicles subscribed (and still monitored) by PyPML are processed,
+        ## results of subscriptions made by the user on the same connection are ignored
+        for vehicle in self._vehicles_with_stops.intersection(self._traci_vehicle_subscription):
+            data = self._traci_vehicle_subscription[vehicle]
+            record = vdb[vehicle]
             ## always to update
-            self._vehicles_db[vehicle]['edge'] = data[tc.VAR_ROAD_ID]
-            self._vehicles_db[vehicle]['passengers'] = data[tc.LAST_STEP_PERSON_ID_LIST]
+            record['edge'] = data[tc.VAR_ROAD_ID]
+            record['passengers'] = data[tc.LAST_STEP_PERSON_ID_LIST]
             for passenger in data[tc.LAST_STEP_PERSON_ID_LIST]:
                 self._passengers_db.add(passenger)
 
             ## stop check
             current_stops = data[tc.VAR_NEXT_STOPS]
-            _new_stops = set()
-            for stop in current_stops:
-                _, _, stopping_place, stop_flags, _, _ = stop
-                if self.is_parking_area(stop_flags):
-                    _new_stops.add(stopping_place)
 
-            if self._is_same_destinations(self._vehicles_db[vehicle]['stops'], current_stops):
+            current_signature = self._stops_signature(current_stops)
+            if _same_destinations(record['stops_signature'], current_signature):
                 ## nothing changed
                 continue
 
@@ -501,48 +825,78 @@ class ParkingMonitor(traci.StepListener):
                 self._logger.debug('[%.2f] Stop change for %s.', step, vehicle)
 
             ## update parking projections
-            _old_stops = set()
-            for _, _, _stop, _flags, _, _ in self._vehicles_db[vehicle]['stops']:
-                if self.is_parking_area(_flags):
-                    _old_stops.add(_stop)
-            v_class = self._vehicles_db[vehicle]['vClass']
+            ## the sets are built only when the destinations changed (the rare case),
+            ## with the old one cached on the vehicle record from the previous change.
+            _old_stops = record['parking_stops']
+            _new_stops = set()
+            for stop in current_stops:
+                _, _, stopping_place, stop_flags, _, _ = stop
+                if stop_flags & 128:
+                    _new_stops.add(stopping_place)
+            v_class = record['vClass']
             for area in _old_stops - _new_stops:
                 ## the vehicle may have already been removed (when added to occupancy_by_vclass)
                 ## if the change in stops is due to a vehilce leaving the parking
-                if vehicle in self._parking_db[area]['projections_by_class'][v_class]:
-                    self._parking_db[area]['projections_by_class'][v_class].remove(vehicle)
+                projections = pdb[area].projections_by_class[v_class]
+                if vehicle in projections:
+                    projections.remove(vehicle)
                     if self._logger:
                         self._logger.debug('[%.2f] Vehicle %s removed from the projections of %s.',
                                            step, vehicle, area)
             for area in _new_stops - _old_stops:
-                self._parking_db[area]['projections_by_class'][v_class].add(vehicle)
+                pdb[area].projections_by_class[v_class].add(vehicle)
                 if self._logger:
                     self._logger.debug('[%.2f] Vehicle %s added to the projections of %s.',
                                        step, vehicle, area)
 
             ## update stops
-            self._vehicles_db[vehicle]['history'].append(
-                self._vehicles_db[vehicle]['stops'])
-            self._vehicles_db[vehicle]['stops'] = current_stops
+            record['history'].append(record['stops'])
+            record['stops'] = current_stops
+            record['stops_signature'] = current_signature
+            record['parking_stops'] = _new_stops
 
             if self._options['subscriptions']['only_parkings'] and not current_stops:
                 if self._logger:
                     self._logger.debug('[%.2f] Unsubscribing from vehicle %s, no additional stops.',
                                        step, vehicle)
                 try:
-                    self._traci_handler.vehicle.unsubscribe(vehicle)
-                except traci.exceptions.TraCIException:
+                    veh.unsubscribe(vehicle)
+                    self._vehicles_with_stops.discard(vehicle)
+                except _TRACI_EXCEPTION:
                     if self._logger:
                         self._logger.critical('[%.2f] Unsubscription failed.', step)
 
     def _check_occupancy(self, step):
-        """ Gather parking current occupancy. """
-        for parking in self._parking_db:
-            occupancy = int(self._traci_handler.simulation.getParameter(parking,
-                                                                        'parkingArea.occupancy'))
-            if self._parking_db[parking]['total_occupancy'] != occupancy:
-                self._parking_db[parking]['occupancy_series'].append((occupancy, step))
-                self._parking_db[parking]['total_occupancy'] = occupancy
+        """ Gather parking current occupancy from the parking area subscriptions. """
+        results = self._traci_handler.parkingarea.getAllSubscriptionResults()
+        if not results:
+            return
+        new_occupancy = numpy.fromiter(
+            (results[pid][tc.VAR_STOP_STARTING_VEHICLES_NUMBER] for pid in self._pid_list),
+            dtype=numpy.int32, count=len(self._pid_list))
+        for pos in numpy.nonzero(new_occupancy != self._occupancy_arr)[0]:
+            parking = self._pid_list[pos]
+            occupancy = int(new_occupancy[pos])
+            entry = self._parking_db[parking]
+            self._append_occupancy_sample(entry, occupancy, step)
+            entry.total_occupancy = occupancy
+        self._occupancy_arr = new_occupancy
+
+    @classmethod
+    def _append_occupancy_sample(cls, parking, occupancy, step):
+        """ Append an (occupancy, step) sample to the chunked series of a parking.
+
+            The series is stored as a list of preallocated numpy chunks instead of a
+            plain list of tuples: growth is amortized and the samples are packed,
+            which keeps memory and GC pressure flat on long simulations.
+        """
+        pos = parking.occupancy_chunk_pos
+        if pos == cls.OCCUPANCY_SERIES_CHUNK:
+            parking.occupancy_chunks.append(
+                numpy.empty((cls.OCCUPANCY_SERIES_CHUNK, 2), dtype=numpy.float64))
+            pos = 0
+        parking.occupancy_chunks[-1][pos] = (occupancy, step)
+        parking.occupancy_chunk_pos = pos + 1
 
     def _get_parking_area_from_vehicle(self, vehicle):
         """ Return the parking area ID of the 'current' stop. """
@@ -557,32 +911,40 @@ class ParkingMonitor(traci.StepListener):
 
         self._check_occupancy(step)
 
+        ## local aliases to avoid the repeated attribute lookups in the loops below
+        pdb = self._parking_db
+        vdb = self._vehicles_db
+
         _to_validate = set()
 
         ## VAR_PARKING_ENDING_VEHICLES_IDS are delayed 1 TS.
         if self._traci_ending_stop_subscriptions:
              ## Update parking capacity by vClass
             for vehicle in self._traci_ending_stop_subscriptions:
-                if vehicle not in self._vehicles_db:
+                if vehicle not in vdb:
                     if self._logger:
                         self._logger.warning(
                             '[%.2f] Vehicle %s stop has ended but it\'s but not in the DB.',
                             step, vehicle)
                     continue
-                self._vehicles_db[vehicle]['stopped'] = False
+                record = vdb[vehicle]
+                record['stopped'] = False
                 if self._logger:
                     self._logger.debug('[%.2f] Vehicle %s is not stopped anymore.',
                                        step, vehicle)
 
-                parking_area = self._vehicles_db[vehicle]['current_parking_area']
-                if not parking_area and self._vehicles_db[vehicle]['roadside']:
-                    self._vehicles_db[vehicle]['roadside'] = False
+                parking_area = record['current_parking_area']
+                if not parking_area and record['roadside']:
+                    record['roadside'] = False
                 else:
-                    if parking_area in self._parking_db:
-                        v_class = self._vehicles_db[vehicle]['vClass']
+                    if parking_area in pdb:
+                        v_class = record['vClass']
+                        parking = pdb[parking_area]
                         try:
-                            self._parking_db[parking_area]['occupancy_by_class'][v_class].remove(
-                                vehicle)
+                            parking.occupancy_by_class[v_class].remove(vehicle)
+                            parking.occupancy_sum -= 1
+                            if parking.free_by_class:
+                                parking.free_by_class[v_class] += 1
                             if self._logger:
                                 self._logger.debug('[%.2f] Vehicle %s removed from %s.',
                                                    step, vehicle, parking_area)
@@ -610,48 +972,51 @@ class ParkingMonitor(traci.StepListener):
         if self._traci_starting_stop_subscriptions:
             ## Update parking capacity by vClass
             for vehicle in self._traci_starting_stop_subscriptions:
-                if vehicle not in self._vehicles_db:
+                if vehicle not in vdb:
                     if self._logger:
                         self._logger.warning('[%.2f] Vehicle %s has stopped but not in the DB.',
                                              step, vehicle)
                     continue
-                self._vehicles_db[vehicle]['stopped'] = True
+                record = vdb[vehicle]
+                record['stopped'] = True
                 if self._logger:
                     self._logger.debug('[%.2f] Vehicle %s is stopping.', step, vehicle)
 
                 parking_area = self._get_parking_area_from_vehicle(vehicle)
                 if parking_area:
-                    if parking_area in self._parking_db:
-                        parking_edge = self._parking_db[parking_area]['sumo']['lane'].split('_')[0]
-                        if self._vehicles_db[vehicle]['edge'] == parking_edge:
-                            v_class = self._vehicles_db[vehicle]['vClass']
-                            self._vehicles_db[vehicle]['current_parking_area'] = parking_area
-                            self._parking_db[parking_area]['projections_by_class'][v_class].remove(
-                                vehicle)
+                    if parking_area in pdb:
+                        parking = pdb[parking_area]
+                        parking_edge = parking.sumo['lane'].split('_')[0]
+                        if record['edge'] == parking_edge:
+                            v_class = record['vClass']
+                            record['current_parking_area'] = parking_area
+                            parking.projections_by_class[v_class].remove(vehicle)
                             if self._logger:
                                 self._logger.debug(
                                     '[%.2f] Vehicle %s removed from the projections of %s.',
                                     step, vehicle, parking_area)
-                            self._parking_db[parking_area]['occupancy_by_class'][v_class].add(
-                                vehicle)
+                            parking.occupancy_by_class[v_class].add(vehicle)
+                            parking.occupancy_sum += 1
+                            if parking.free_by_class:
+                                parking.free_by_class[v_class] -= 1
                             if self._logger:
                                 self._logger.debug('[%.2f] Vehicle %s added to %s.',
                                                    step, vehicle, parking_area)
                             _to_validate.add(parking_area)
                         else:
                             import pprint
-                            pprint.pprint(self._vehicles_db[vehicle])
+                            pprint.pprint(record)
                             raise ParkingMonitorGenericError(
                                 'Vehicle {} [{}] cannot park in {} [{}]: location error.'.format(
-                                    vehicle, self._vehicles_db[vehicle]['edge'],
+                                    vehicle, record['edge'],
                                     parking_area, parking_edge))
                     else:
                         if self._logger:
                             self._logger.debug('[%.2f] Parking area %s not monitored.',
                                                step, parking_area)
                 else:
-                    self._vehicles_db[vehicle]['roadside'] = True
-                    self._vehicles_db[vehicle]['current_parking_area'] = None
+                    record['roadside'] = True
+                    record['current_parking_area'] = None
                     if self._logger:
                         self._logger.debug(
                             '[%.2f] Vehicle %s is stopping outside a parking area.', step, vehicle)
@@ -667,11 +1032,11 @@ class ParkingMonitor(traci.StepListener):
 
     def get_traci_vehicle_subscriptions(self):
         """ Return TraCI vehicle subscriptions for the last simulation-step. """
-        return copy.deepcopy(self._traci_vehicle_subscription)
+        return _shallow_snapshot(self._traci_vehicle_subscription)
 
     def get_traci_simulation_subscriptions(self):
         """ Return TraCI simulation subscriptions for the last simulation-step. """
-        return copy.deepcopy(self._traci_simulation_subscriptions)
+        return _shallow_snapshot(self._traci_simulation_subscriptions)
 
     ## ===============================          REROUTERS         ============================== ##
 
@@ -682,13 +1047,11 @@ class ParkingMonitor(traci.StepListener):
         """
         for value in self._routers_db.values():
             current = None
-            for end, parkings in value['intervals']:
-                if not current:
-                    current = parkings
-                if step <= end:
-                    current = parkings
-                else:
-                    break
+            if value['intervals_parkings']:
+                ## first interval ending at or after the step, clamped to the last one
+                pos = numpy.searchsorted(value['intervals_end'], step)
+                current = value['intervals_parkings'][
+                    min(pos, len(value['intervals_parkings']) - 1)]
             yield {
                 'id': value['id'],
                 'edges': value['edges'],
@@ -705,9 +1068,13 @@ class ParkingMonitor(traci.StepListener):
     ## ===============================          VEHICLES         =============================== ##
 
     def get_vehicle_iterator(self):
-        """ Return the vehicle info. """
+        """ Return the vehicle info.
+
+            The records are yielded as read-only views, without copies.
+            Use get_vehicle() to obtain an isolated copy of a specific vehicle.
+        """
         for value in self._vehicles_db.values():
-            yield value
+            yield types.MappingProxyType(value)
 
     def get_vehicle(self, vehicle):
         """ Return the vehicle with the given ID or None if not existent.
@@ -715,7 +1082,7 @@ class ParkingMonitor(traci.StepListener):
             vehicle: String. Vehicle ID as defined in SUMO.
         """
         if vehicle in self._vehicles_db:
-            return copy.deepcopy(self._vehicles_db[vehicle])
+            return _shallow_snapshot(self._vehicles_db[vehicle])
         return None
 
     def set_vehicle_param(self, vehicle, param, value):
@@ -727,26 +1094,45 @@ class ParkingMonitor(traci.StepListener):
             value:   Any. Value for the parameter.
             """
         if vehicle in self._vehicles_db:
-            self._vehicles_db[vehicle][param] = copy.deepcopy(value)
+            self._vehicles_db[vehicle][param] = _shallow_snapshot(value)
             return True
         return False
 
     ## ===============================          PARKINGS         =============================== ##
 
     def get_parking_iterator(self):
-        """ Return the parking iterator. """
+        """ Return the parking iterator.
+
+            The records are yielded as read-only views, without copies.
+            Use get_parking() to obtain an isolated copy of a specific parking area.
+        """
         for value in self._parking_db.values():
-            yield copy.deepcopy(value)
+            yield types.MappingProxyType(value)
 
     def get_parking(self, parking):
         """ Return the parking area with the given ID or None if not existent.
 
             parking: String. Parking area ID as defined in SUMO.
         """
-        if parking in self._parking_db:
-            return copy.deepcopy(self._parking_db[parking])
+        entry = self._parking_db.get(parking)
+        if entry is not None:
+            return _shallow_snapshot(entry)
         return None
 
+    def get_occupancy_series(self, parking):
+        """ Return the (occupancy, step) series of the given parking area.
+            Raises an ParkingMonitorGenericError if the requested parking area does not exist.
+
+            parking: String. Parking area ID as defined in SUMO.
+        """
+        entry = self._parking_db.get(parking)
+        if entry is None:
+            raise ParkingAreaNotFoundError(parking)
+        chunks = entry.occupancy_chunks
+        pos = entry.occupancy_chunk_pos
+        samples = numpy.concatenate(chunks[:-1] + [chunks[-1][:pos]])
+        return [(int(occupancy), step) for occupancy, step in samples]
+
     def compute_parking_travel_time(self):
         """ For each parking, saves the parkings reachable by 'passenger' vClass where the weight
             is the travel time at the current stage of the simulation.
@@ -757,11 +1143,15 @@ class ParkingMonitor(traci.StepListener):
 
         parkings = []
         for parking in self._parking_db.values():
-            pid = parking['sumo']['id']
-            edge = parking['sumo']['lane'].split('_')[0]
-            end_pos = float(parking['sumo']['endPos'])
+            pid = parking.sumo['id']
+            edge = parking.sumo['lane'].split('_')[0]
+            end_pos = float(parking.sumo['endPos'])
             parkings.append((pid, edge, end_pos))
 
+        ## Many parkings share the same edge and the routing cost only depends on the
+        ## (from_edge, to_edge) pair, so findRoute is called once per unique pair.
+        route_cost_cache = dict()
+
         for from_pid, from_edge, from_end_pos in parkings:
             for to_pid, to_edge, to_end_pos in parkings:
                 if from_pid == to_pid:
@@ -773,17 +1163,21 @@ class ParkingMonitor(traci.StepListener):
                     ##  route not available
                     continue
 
-                route = None
-                try:
-                    route = self._traci_handler.simulation.findRoute(from_edge, to_edge,
-                                                                     vType='passenger')
-                except traci.exceptions.TraCIException:
+                if (from_edge, to_edge) in route_cost_cache:
+                    cost = route_cost_cache[(from_edge, to_edge)]
+                else:
                     route = None
-                    self._blacklisted_edges_pairs[from_edge].append(to_edge)
-
-                cost = None
-                if route and route.edges:
-                    cost = route.travelTime
+                    try:
+                        route = self._traci_handler.simulation.findRoute(from_edge, to_edge,
+                                                                         vType='passenger')
+                    except _TRACI_EXCEPTION:
+                        route = None
+                        self._blacklisted_edges_pairs[from_edge].add(to_edge)
+
+                    cost = None
+                    if route and route.edges:
+                        cost = route.travelTime
+                    route_cost_cache[(from_edge, to_edge)] = cost
 
                 if cost:
                     self._static_parking_travel_time[from_pid].append((cost, to_pid))
@@ -805,13 +1199,13 @@ class ParkingMonitor(traci.StepListener):
             raise ParkingMonitorGenericError(
                 'Estimated travel time structure for parkings is not initialized.')
 
-        parkings = []
         if parking in self._static_parking_travel_time:
-            for item in self._static_parking_travel_time[parking]:
-                if num and len(parkings) == num:
-                    break
-                parkings.append(item)
-        return parkings
+            distances = self._static_parking_travel_time[parking]
+            if num:
+                ## C-level slice instead of an append loop with a length check
+                return distances[:num]
+            return list(distances)
+        return []
 
     ## ============================     PARKING SUBSCRIPTIONS      ============================= ##
 
@@ -821,9 +1215,10 @@ class ParkingMonitor(traci.StepListener):
 
             parking: String. Parking area ID as defined in SUMO.
         """
-        if parking in self._parking_db.keys():
-            return copy.deepcopy(self._parking_db[parking]['subscriptions_by_class'])
-        raise ParkingMonitorGenericError('Parking {} does not exist.'.format(parking))
+        entry = self._parking_db.get(parking)
+        if entry is not None:
+            return _shallow_snapshot(entry.subscriptions_by_class)
+        raise ParkingAreaNotFoundError(parking)
 
     def set_parking_subscriptions(self, parking, subscriptions):
         """ Set the given subsctiption to the parking id.
@@ -833,11 +1228,13 @@ class ParkingMonitor(traci.StepListener):
             parking:       String. Parking area ID as defined in SUMO.
             subscriptions: Dict. { 'vType': int, .., 'vType': int }
         """
-        if parking in self._parking_db:
-            self._parking_db[parking]['subscriptions_by_class'] = copy.deepcopy(subscriptions)
+        entry = self._parking_db.get(parking)
+        if entry is not None:
+            entry.subscriptions_by_class = {
+                key: _Subscription(num, veh) for key, (num, veh) in subscriptions.items()}
             self._validate_parking_subscriptions(parking)
         else:
-            raise ParkingMonitorGenericError('Parking {} does not exist.'.format(parking))
+            raise ParkingAreaNotFoundError(parking)
 
     def subscribe_vehicle_to_parking(self, parking, vclass, vehicle):
         """ Add the vehicle to the subscription list of the parking area.
@@ -850,13 +1247,15 @@ class ParkingMonitor(traci.StepListener):
             vclass:  String. vType as defined in SUMO.
             vehicle: String. Vehicle ID as defined in SUMO.
         """
-        if parking in self._parking_db:
-            if vclass in self._parking_db[parking]['subscriptions_by_class']:
-                _capacity, vehicles = self._parking_db[parking]['subscriptions_by_class'][vclass]
-                if vehicle in vehicles:
+        entry = self._parking_db.get(parking)
+        if entry is not None:
+            sub = entry.subscriptions_by_class.get(vclass)
+            if sub is not None:
+                if vehicle in sub.vehicles:
                     return False
-                if len(vehicles) < _capacity:
-                    vehicles.add(vehicle)
+                if sub.free > 0:
+                    sub.vehicles = sub.vehicles | {vehicle}
+                    sub.free -= 1
                     return True
                 # subscription full
                 return False
@@ -864,7 +1263,7 @@ class ParkingMonitor(traci.StepListener):
                 raise ParkingMonitorGenericError(
                     'vClass "{}" not initialized in parking {}.'.format(vclass, parking))
         else:
-            raise ParkingMonitorGenericError('Parking {} does not exist.'.format(parking))
+            raise ParkingAreaNotFoundError(parking)
 
     def remove_subscribed_vehicle(self, parking, vclass, vehicle):
         """ Remove the vehicles from the subscriptions of the given parking id.
@@ -875,11 +1274,13 @@ class ParkingMonitor(traci.StepListener):
             vclass:  String. vType as defined in SUMO.
             vehicle: String. Vehicle ID as defined in SUMO.
         """
-        if parking in self._parking_db:
-            if vclass in self._parking_db[parking]['subscriptions_by_class']:
-                _capacity, vehicles = self._parking_db[parking]['subscriptions_by_class'][vclass]
-                if vehicle in vehicles:
-                    vehicles.remove(vehicle)
+        entry = self._parking_db.get(parking)
+        if entry is not None:
+            sub = entry.subscriptions_by_class.get(vclass)
+            if sub is not None:
+                if vehicle in sub.vehicles:
+                    sub.vehicles = sub.vehicles - {vehicle}
+                    sub.free += 1
                     return True
                 # vehicle not found
                 return False
@@ -887,7 +1288,7 @@ class ParkingMonitor(traci.StepListener):
                 raise ParkingMonitorGenericError(
                     'vClass "{}" not initialized in parking {}.'.format(vclass, parking))
         else:
-            raise ParkingMonitorGenericError('Parking {} does not exist.'.format(parking))
+            raise ParkingAreaNotFoundError(parking)
 
     ## ============================       PARKING PROJECTIONS      ============================= ##
 
@@ -897,9 +1298,10 @@ class ParkingMonitor(traci.StepListener):
 
             parking: String. Parking area ID as defined in SUMO.
         """
-        if parking in self._parking_db.keys():
-            return copy.deepcopy(self._parking_db[parking]['projection_by_class'])
-        raise ParkingMonitorGenericError('Parking {} does not exist.'.format(parking))
+        entry = self._parking_db.get(parking)
+        if entry is not None:
+            return _shallow_snapshot(entry.projections_by_class)
+        raise ParkingAreaNotFoundError(parking)
 
     ## ============================  PARKING CAPACITY - OCCUPANCY  ============================= ##
 
@@ -915,61 +1317,114 @@ class ParkingMonitor(traci.StepListener):
             with_subscriptions: Boolean. If True, subscriptions are taken into account.
         """
 
-        if parking not in self._parking_db.keys():
-            raise ParkingMonitorGenericError('Parking {} does not exist.'.format(parking))
+        entry = self._parking_db.get(parking)
+        if entry is None:
+            raise ParkingAreaNotFoundError(parking)
+
+        if not (with_uncertainty or with_projections or with_subscriptions):
+            ## fast path: the plain free places are maintained incrementally
+            free_by_class = entry.free_by_class
+            if not free_by_class:
+                ## no per-class capacity: the most common call is plain arithmetic
+                return entry.total_capacity - entry.total_occupancy
+            if vclass in free_by_class:
+                return free_by_class[vclass]
+            return dict(free_by_class)
 
         error = 0
         if with_uncertainty:
-            error = round(self._random.normal(self._parking_db[parking]['uncertainty']['mu'],
-                                              self._parking_db[parking]['uncertainty']['sigma']))
+            mu, sigma = entry.uncertainty
+            error = int(round(self._random.normal(mu, sigma)))
 
-        current_capacity = dict()
-        for key, capacity in self._parking_db[parking]['capacity_by_class'].items():
-            current_capacity[key] = capacity
+        capacity_by_class = entry.capacity_by_class
+        occupancy_by_class = entry.occupancy_by_class
+        projections_by_class = entry.projections_by_class
+        total_occupancy = entry.total_occupancy
 
-        total_occupancy = self._parking_db[parking]['total_occupancy']
-        occupancy = dict()
-        for key, values in self._parking_db[parking]['occupancy_by_class'].items():
-            occupancy[key] = set(values)
+        ## The used places are counted per class without materializing set unions:
+        ## occupancy and projections are disjoint by construction, only the
+        ## subscribed vehicles can overlap the other two.
+        used = {key: len(values) for key, values in occupancy_by_class.items()}
 
         total_projections = 0
         if with_projections:
-            for key, vehicles in self._parking_db[parking]['projections_by_class'].items():
+            for key, vehicles in projections_by_class.items():
                 total_projections += len(vehicles)
-                occupancy[key] = occupancy[key] | vehicles
+                occ = occupancy_by_class[key]
+                if vehicles.isdisjoint(occ):
+                    used[key] += len(vehicles)
+                else:
+                    used[key] += len(vehicles - occ)
 
         total_subscriptions = 0
-        partial_subscriptions = 0
         subscriptions = dict()
         if with_subscriptions:
-            for key, (num, veh) in self._parking_db[parking]['subscriptions_by_class'].items():
-                subscriptions[key] = num - len(veh)
-                occupancy[key] = occupancy[key] | veh
-                total_subscriptions += num
-                partial_subscriptions += subscriptions[key]
-
-        if current_capacity:
-            for key, vehicles in occupancy.items():
-                current_capacity[key] += error
-                current_capacity[key] -= len(vehicles)
-                if with_subscriptions and subscriptions:
-                    current_capacity[key] -= subscriptions[key]
+            for key, sub in entry.subscriptions_by_class.items():
+                subscriptions[key] = sub.free
+                total_subscriptions += sub.capacity
+                extra = sub.vehicles - occupancy_by_class[key]
+                if with_projections:
+                    extra -= projections_by_class[key]
+                used[key] += len(extra)
+
+        if capacity_by_class:
+            if subscriptions:
+                current_capacity = {
+                    key: capacity + error - used[key] - subscriptions[key]
+                    for key, capacity in capacity_by_class.items()}
+            else:
+                current_capacity = {
+                    key: capacity + error - used[key]
+                    for key, capacity in capacity_by_class.items()}
             if vclass in current_capacity:
                 return current_capacity[vclass]
             return current_capacity
 
-        return (self._parking_db[parking]['total_capacity'] - total_occupancy -
+        return (entry.total_capacity - total_occupancy -
                 total_projections - total_subscriptions + error)
 
+    def get_free_places_batch(self, parkings=None, with_uncertainty=False):
+        """ Returns the total free places of many parking areas at once.
+
+            The query is answered from the parallel numpy arrays maintained by
+            the occupancy check, so the whole batch costs a single vectorized
+            expression instead of one Python call per parking area. The values
+            are the plain totals, i.e. the batch equivalent of the
+            get_free_places fast path (no per-class split, projections or
+            subscriptions).
+            Raises an ParkingAreaNotFoundError if a requested parking area
+            does not exist.
+
+            parkings:         Iterable of parking area IDs, or None for all
+                              the monitored parking areas.
+            with_uncertainty: Boolean. If True, uncertainty is applied.
+        """
+        free = self._capacity_arr - self._occupancy_arr
+        if with_uncertainty:
+            noise = self._random.normal(self._mu_arr, self._sigma_arr)
+            free = free + numpy.rint(noise).astype(numpy.int32)
+        if parkings is None:
+            return {pid: int(free[idx]) for pid, idx in self._pid_to_idx.items()}
+        pid_to_idx = self._pid_to_idx
+        places = dict()
+        for pid in parkings:
+            idx = pid_to_idx.get(pid)
+            if idx is None:
+                raise ParkingAreaNotFoundError(pid)
+            places[pid] = int(free[idx])
+        return places
+
     def get_parking_capacity_vclass(self, parking):
         """ Given a parking ID, returns the capacity by vclass information.
             Raises an ParkingMonitorGenericError if the requested parking area does not exist.
 
             parking: String. Parking area ID as defined in SUMO.
         """
-        if parking in self._parking_db.keys():
-            return copy.deepcopy(self._parking_db[parking]['capacity_by_class'])
-        raise ParkingMonitorGenericError('Parking {} does not exist.'.format(parking))
+        entry = self._parking_db.get(parking)
+        if entry is not None:
+            ## flat {vType: number} dict
+            return dict(entry.capacity_by_class)
+        raise ParkingAreaNotFoundError(parking)
 
     def set_parking_capacity_vclass(self, parking, capacities):
         """ Set the given capacity by vclass to the parking id.
@@ -979,78 +1434,92 @@ class ParkingMonitor(traci.StepListener):
             parking:    String. Parking area ID as defined in SUMO.
             capacities: Dict. { 'vType': int, .., 'vType': int }
         """
-        if parking in self._parking_db:
-            self._parking_db[parking]['capacity_by_class'] = copy.deepcopy(capacities)
+        entry = self._parking_db.get(parking)
+        if entry is not None:
+            entry.capacity_by_class = copy.deepcopy(capacities)
+            entry.capacity_sum = sum(entry.capacity_by_class.values())
             self._validate_parking_capacity(parking)
+            ## keep the incremental free-places counters in sync with the new capacity
+            entry.free_by_class = {
+                key: value - len(entry.occupancy_by_class[key])
+                for key, value in entry.capacity_by_class.items()}
         else:
-            raise ParkingMonitorGenericError('Parking {} does not exist.'.format(parking))
+            raise ParkingAreaNotFoundError(parking)
 
     ## ============================       PARKING VALIDATION       ============================= ##
 
     def _validate_parking_capacity(self, parking):
         """ Checks if the sum of all the 'capacity_by_class' matches the 'total_capacity. """
 
-        if set(self._parking_db[parking]['capacity_by_class'].keys()) != self._options['vclasses']:
+        entry = self._parking_db[parking]
+        if entry.capacity_by_class.keys() != self._options['vclasses']:
             raise ParkingMonitorGenericError(
                 """The vClasses in "capacity_by_class" of {} must be all and """
                 """only {} [see parameter "vclasses"].""".format(
                     parking, self._options['vclasses']))
 
-        total = 0
-        for value in self._parking_db[parking]['capacity_by_class'].values():
-            total += value
-        if total != self._parking_db[parking]['total_capacity']:
+        ## capacity_sum is maintained wherever capacity_by_class is replaced,
+        ## so the invariant check is a single int compare
+        if entry.capacity_sum != entry.total_capacity:
             raise ParkingMonitorGenericError(
                 """The total capacity for parking area {} is {} but it must be """
                 """equal to the one defined in SUMO: {}.""".format(
-                    parking, total, self._parking_db[parking]['total_capacity']))
+                    parking, entry.capacity_sum, entry.total_capacity))
 
     def _validate_parking_occupancy(self, parking):
         """ Checks if the sum of all the 'occupancy_by_class' matches the 'total_occupancy. """
 
-        if set(self._parking_db[parking]['occupancy_by_class'].keys()) != self._options['vclasses']:
+        entry = self._parking_db[parking]
+        if entry.occupancy_by_class.keys() != self._options['vclasses']:
             raise ParkingMonitorGenericError(
                 """The vClasses in "occupancy_by_class" of {} must be all and """
                 """only {} [see parameter "vclasses"].""".format(
                     parking, self._options['vclasses']))
 
-        total = 0
-        for v_class, value in self._parking_db[parking]['occupancy_by_class'].items():
-            if self._parking_db[parking]['capacity_by_class']:
-                info = (
-                    "The occupancy in parking area {} for vType {} is {} of {}.".format(
-                        parking, v_class, len(value),
-                        self._parking_db[parking]['capacity_by_class'][v_class]))
+        ## the dicts are bound once outside the loop, and the per-class capacity
+        ## is fetched a single time per joint iteration
+        capacity_by_class = entry.capacity_by_class
+        if capacity_by_class:
+            for v_class, value in entry.occupancy_by_class.items():
+                capacity = capacity_by_class[v_class]
                 if self._logger:
-                    self._logger.debug(info)
-                if len(value) > self._parking_db[parking]['capacity_by_class'][v_class]:
-                    raise ParkingMonitorGenericError(info)
-            total += len(value)
-        if total != self._parking_db[parking]['total_occupancy']:
+                    ## formatting is deferred to the logging layer: the string is
+                    ## built only if the DEBUG level is actually enabled
+                    self._logger.debug(
+                        'The occupancy in parking area %s for vType %s is %d of %d.',
+                        parking, v_class, len(value), capacity)
+                if len(value) > capacity:
+                    raise ParkingMonitorGenericError(
+                        "The occupancy in parking area {} for vType {} is {} of {}.".format(
+                            parking, v_class, len(value), capacity))
+        ## occupancy_sum is adjusted wherever occupancy_by_class is mutated,
+        ## so the invariant check is a single int compare
+        if entry.occupancy_sum != entry.total_occupancy:
             raise ParkingMonitorGenericError(
                 """The total occupancy for parking area {} is {} but it must be """
                 """equal to the one retrieved from SUMO: {}.""".format(
-                    parking, total, self._parking_db[parking]['total_occupancy']))
+                    parking, entry.occupancy_sum, entry.total_occupancy))
 
     def _validate_parking_subscriptions(self, parking):
         """ Checks if the sum of all the 'subscriptions_by_class' matches the 'total_occupancy. """
 
-        if not self._parking_db[parking]['capacity_by_class']:
+        entry = self._parking_db[parking]
+        if not entry.capacity_by_class:
             raise ParkingMonitorGenericError(
                 """Parking subscriptions for parking {} cannot be set without """
                 """setting 'capacity_by_class' in advance.""".format(parking))
 
-        if (set(self._parking_db[parking]['subscriptions_by_class'].keys())
-                != self._options['vclasses']):
+        if entry.subscriptions_by_class.keys() != self._options['vclasses']:
             raise ParkingMonitorGenericError(
                 """The vClasses in "subscriptions_by_class" of {} must be all and """
                 """only {} [see parameter "vclasses"].""".format(
                     parking, self._options['vclasses']))
 
-        for key, value in self._parking_db[parking]['subscriptions_by_class'].items():
-            if value[0] > self._parking_db[parking]['capacity_by_class'][key]:
+        capacity_by_class = entry.capacity_by_class
+        for key, value in entry.subscriptions_by_class.items():
+            if value.capacity > capacity_by_class[key]:
                 raise ParkingMonitorGenericError(
                     "In parking {}, subscription for {} exceed the capacity [{}/{}].".format(
-                        parking, key, value, self._parking_db[parking]['capacity_by_class'][key]))
+                        parking, key, value, capacity_by_class[key]))
 
     ## ========================================================================================= ##
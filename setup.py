@@ -25,6 +25,10 @@ setup(name='pypml',
       license='EPL-2.0',
       packages=['pypml'],
       install_requires=[],
+      extras_require={
+          ## optional JIT acceleration of the numeric helpers (see pypml.py)
+          'numba': ['numba'],
+      },
       include_package_data=True,
       zip_safe=False,
       test_suite='nose.collector',